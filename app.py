@@ -1,158 +1,411 @@
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import mtr_timetable_github as mtr
 import os
+import hashlib
 import json
-import pickle
-from datetime import datetime, timezone, timedelta
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache, wraps
+
+try:
+    import orjson  # 可选依赖，安装后用于加速JSON序列化
+except ImportError:
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    '''使用orjson进行JSON序列化，接口行为与默认实现相同'''
+    def dumps(self, obj, **kwargs):
+        # 与默认实现一样按键排序输出
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+else:
+    # 与orjson一样直接输出UTF-8字符，使两种实现的响应内容完全相同
+    app.json.ensure_ascii = False
 
 # 数据文件路径设置
 DATA_PATH = '.'
 DATABASE_PATH = '.'
+DATA_JSON = os.path.join(DATA_PATH, 'data.json')
+DATA_V3_JSON = os.path.join(DATA_PATH, 'data_v3.json')
+STATION_DAT = os.path.join(DATABASE_PATH, 'station_timetable_data.dat')
+TRAIN_DAT = os.path.join(DATABASE_PATH, 'train_timetable_data.dat')
+STATION_TEMPLATE = os.path.join(DATABASE_PATH, 'station_template.htm')
+# 时刻表使用的时区偏移（+8）
+TZ_OFFSET = 8 * 60 * 60
+
+
+def _read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# 数据快照中的属性名 -> (文件路径, 读取函数)
+_DATA_FILES = {
+    'data': (DATA_JSON, _read_json),
+    'data_v3': (DATA_V3_JSON, _read_json),
+    # 时刻表数据使用mtr模块中只允许基本类型的pickle读取函数
+    'station_timetable': (STATION_DAT, mtr._read_pickle),
+    'train_timetable': (TRAIN_DAT, mtr._read_pickle),
+}
+# 后台检查数据文件是否更新的间隔（秒）
+REFRESH_INTERVAL = 60
+
+def _data_mtimes():
+    mtimes = {}
+    for name, (path, _) in _DATA_FILES.items():
+        try:
+            mtimes[name] = os.path.getmtime(path)
+        except OSError:
+            mtimes[name] = None
+    return mtimes
+
+def _prefetch(path):
+    # 提示内核预读整个文件，多个文件的磁盘读取可以同时进行
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class _Snapshot:
+    '''某一时刻全部数据文件的内容，创建后不再修改，可以在多个线程间共享'''
+    def __init__(self, mtimes, previous=None):
+        self.mtimes = mtimes
+        # 未修改的文件直接沿用旧快照中的数据
+        changed = [name for name in _DATA_FILES
+                   if previous is None or previous.mtimes[name] != mtimes[name]]
+        for name in changed:
+            _prefetch(_DATA_FILES[name][0])
+        for name, (path, read) in _DATA_FILES.items():
+            if name in changed:
+                setattr(self, name, read(path))
+            else:
+                setattr(self, name, getattr(previous, name))
+
+        # 线路ID -> 线路第一个车站的ID，作为线路查询的默认车站
+        self.route_default_station = {route_id: route['stations'][0]['id']
+                                      for route_id, route in self.data['routes'].items()
+                                      if route['stations']}
+        # 重复的查询直接返回之前的结果，缓存随快照一起替换
+        self.route_ids = lru_cache(maxsize=1024)(self._route_ids)
+        self.train = lru_cache(maxsize=4096)(self._train)
+
+    def _route_ids(self, route_name):
+        return tuple(mtr.route_name_to_id(self.data_v3, route_name))
+
+    def _train(self, station_name, train_id):
+        return mtr.get_train(self.data, station_name, train_id,
+                             self.station_timetable, self.train_timetable)
+
+# 当前使用的数据快照。后台线程加载好新数据后整体替换引用，
+# 请求只读取引用，拿到的要么是旧数据要么是新数据，不会读到一半更新的数据
+_snapshot = None
+_snapshot_lock = threading.Lock()
+_refresher_started = False
+
+def _refresh_loop():
+    global _snapshot
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        mtimes = _data_mtimes()
+        if mtimes == _snapshot.mtimes:
+            continue
+        try:
+            _snapshot = _Snapshot(mtimes, _snapshot)
+        except Exception:
+            # 文件可能正在写入，继续使用旧数据，下次再试
+            app.logger.exception('重新加载数据失败')
+
+def _load_snapshot():
+    '''返回当前的数据快照，尚未加载时先加载数据，不启动刷新线程'''
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = _Snapshot(_data_mtimes())
+    return _snapshot
+
+def _current():
+    '''返回当前的数据快照，每个进程首次调用时启动后台刷新线程'''
+    global _refresher_started
+    snapshot = _load_snapshot()
+    if not _refresher_started:
+        with _snapshot_lock:
+            if not _refresher_started:
+                threading.Thread(target=_refresh_loop, daemon=True).start()
+                _refresher_started = True
+    return snapshot
+
+def _reset_refresher():
+    # fork出的子进程中没有刷新线程，首次使用时重新启动
+    global _snapshot_lock, _refresher_started
+    _snapshot_lock = threading.Lock()
+    _refresher_started = False
+
+os.register_at_fork(after_in_child=_reset_refresher)
+
+def preload_data():
+    '''预先加载全部数据，供多进程部署时在主进程中调用。
+    这里不启动刷新线程，由每个工作进程在首次处理请求时各自启动'''
+    _load_snapshot()
+
+def warmup():
+    '''在启动时执行一次车站查询，让首个用户请求不必承担首次执行的开销'''
+    snapshot = _load_snapshot()
+    for station in snapshot.data['stations'].values():
+        mtr.get_text_timetable(snapshot.data, station['name'], TZ_OFFSET,
+                               snapshot.station_timetable)
+        break
+
+# 接口响应缓存的有效期（秒）：车站时刻表与当前时间相关，线路和列车信息只与数据有关
+_CACHE_TTL = {'short': 10, 'long': 300}
+_CACHE_MAX_SIZE = 4096
+# 响应缓存：(接口, 数据文件修改时间, 表单参数) -> (过期时间, 响应内容)
+_response_cache = {}
+# 请求线程共享响应缓存，读取、写入和淘汰都要在锁内进行
+_cache_lock = threading.Lock()
+
+# 正在计算中的请求：键 -> Future
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def _single_flight(key, func):
+    '''相同键的并发请求只计算一次，其余请求等待并共享同一个结果'''
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        return future.result()
+
+    try:
+        result = func()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+def _json_bytes(obj):
+    '''序列化为紧凑、按键排序的UTF-8 JSON，是否安装orjson输出都相同'''
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return app.json.dumps(obj, separators=(',', ':')).encode()
+
+def _cache_version():
+    '''当前快照的数据文件修改时间，数据刷新后旧的缓存不再命中'''
+    try:
+        return tuple(_current().mtimes.items())
+    except Exception:
+        # 数据加载失败时由接口自身返回错误信息
+        return None
+
+def _success(body):
+    '''创建成功结果的响应，并标记为可以由etagged添加缓存头'''
+    response = app.response_class(body, mimetype='application/json')
+    response.cacheable = True
+    return response
+
+def cached(policy):
+    '''按接口和表单参数缓存成功的响应，查询出错时若有过期的缓存则返回旧的结果'''
+    ttl = _CACHE_TTL[policy]
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # 接口用request.form.get读取参数，只取每个参数的第一个值，
+            # 键也按第一个值构建，才能保证相同的键对应相同的结果
+            key = (request.endpoint, _cache_version(),
+                   tuple(sorted(request.form.to_dict().items())))
+            now = time.monotonic()
+            with _cache_lock:
+                entry = _response_cache.get(key)
+            if entry is not None and entry[0] > now:
+                return _success(entry[1])
+
+            def compute():
+                # 成功时接口返回dict，在这里序列化一次，之后命中缓存直接返回字节串；
+                # 出错时接口返回的是错误响应
+                result = func(*args, **kwargs)
+                if isinstance(result, dict):
+                    return _json_bytes(result), False
+                return result.get_data(), True
+
+            body, failed = _single_flight(key, compute)
+            if failed:
+                if entry is not None:
+                    return _success(entry[1])
+                return app.response_class(body, mimetype='application/json')
+
+            with _cache_lock:
+                _response_cache.pop(key, None)
+                _response_cache[key] = (now + ttl, body)
+                if len(_response_cache) > _CACHE_MAX_SIZE:
+                    del _response_cache[next(iter(_response_cache))]
+            return _success(body)
+        return wrapper
+    return decorator
+
+def etagged(func):
+    '''为成功的响应添加ETag，客户端已有相同内容时返回304；错误响应保持不变'''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        response = func(*args, **kwargs)
+        if response.status_code != 200 or not getattr(response, 'cacheable', False):
+            return response
+        etag = hashlib.blake2b(response.get_data(), digest_size=8).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'max-age=10'
+        return response
+    return wrapper
+
+def _prebuilt_error(message):
+    return app.json.response({'error': message}).get_data()
+
+# 固定的错误信息在启动时序列化一次，请求时只需创建响应对象
+ERR_NO_STATION = _prebuilt_error('请输入车站名称')
+ERR_NO_ROUTE = _prebuilt_error('请输入线路名称')
+ERR_NO_TRAIN_ARGS = _prebuilt_error('请输入车站名称和列车ID')
+ERR_STATION_NOT_FOUND = _prebuilt_error('未找到该车站信息')
+ERR_ROUTE_NOT_FOUND = _prebuilt_error('未找到该线路信息')
+ERR_ROUTE_NO_STATION = _prebuilt_error('无法找到线路的车站信息')
+ERR_ROUTE_NO_TRAIN = _prebuilt_error('该线路无列车数据')
+ERR_TRAIN_NOT_FOUND = _prebuilt_error('未找到该列车信息')
+
+def _error(body):
+    return app.response_class(body, mimetype='application/json')
+
+def _format_schedule(stations):
+    '''将mtr返回的(名称, 到达, 发车, ID)元组列表转换为接口输出格式'''
+    return [{'name': name, 'arrival': arrival, 'departure': departure, 'id': station_id}
+            for name, arrival, departure, station_id in stations]
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/station', methods=['POST'])
+@etagged
+@cached('short')
 def station_query():
     station_name = request.form.get('station_name')
     if not station_name:
-        return jsonify({'error': '请输入车站名称'})
+        return _error(ERR_NO_STATION)
     
     try:
-        # 加载数据
-        with open(os.path.join(DATA_PATH, 'data.json'), 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        snapshot = _current()
         
-        # 加载车站时刻表数据
-        with open(os.path.join(DATABASE_PATH, 'station_timetable_data.dat'), 'rb') as f:
-            station_timetable = pickle.load(f)
-        
-        # 获取当前时间
-        tz = 8
-        dtz = timezone(timedelta(hours=tz))
-        departure_time = round(datetime.now().astimezone(dtz).replace(tzinfo=timezone.utc).timestamp())
+        # 获取当前时间（UTC+8的本地时间戳）
+        departure_time = round(time.time()) + TZ_OFFSET
         
         # 获取车站文本时刻表
-        timetable = mtr.main_text_timetable(os.path.join(DATA_PATH, 'data.json'), 
-                                           DATABASE_PATH, 
-                                           departure_time, 
-                                           station_name)
+        timetable = mtr.get_text_timetable(snapshot.data, station_name,
+                                           departure_time, snapshot.station_timetable)
         
         if timetable is None:
-            return jsonify({'error': '未找到该车站信息'})
+            return _error(ERR_STATION_NOT_FOUND)
         
-        return jsonify({
+        return {
             'station': station_name,
             'timetable': timetable
-        })
+        }
     except FileNotFoundError as e:
         return jsonify({'error': f'数据文件未找到: {str(e)}'})
     except Exception as e:
         return jsonify({'error': str(e)})
 
 @app.route('/route', methods=['POST'])
+@etagged
+@cached('long')
 def route_query():
     route_name = request.form.get('route_name')
     if not route_name:
-        return jsonify({'error': '请输入线路名称'})
+        return _error(ERR_NO_ROUTE)
     
     try:
-        # 加载数据
-        with open(os.path.join(DATA_PATH, 'data_v3.json'), 'r', encoding='utf-8') as f:
-            data_v3 = json.load(f)
-        
-        with open(os.path.join(DATA_PATH, 'data.json'), 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 加载车站时刻表数据
-        with open(os.path.join(DATABASE_PATH, 'station_timetable_data.dat'), 'rb') as f:
-            station_timetable = pickle.load(f)
+        snapshot = _current()
         
         # 尝试获取线路的第一个车站作为默认车站
         default_station = None
-        route_ids = mtr.route_name_to_id(data_v3, route_name)
+        route_ids = snapshot.route_ids(route_name)
         if route_ids:
-            route_id = route_ids[0]
-            if route_id in data['routes']:
-                stations = data['routes'][route_id]['stations']
-                if stations:
-                    default_station = stations[0]['id']
+            default_station = snapshot.route_default_station.get(route_ids[0])
         
         if not default_station:
-            return jsonify({'error': '无法找到线路的车站信息'})
+            return _error(ERR_ROUTE_NO_STATION)
         
         # 获取线路时刻表
-        timetable = mtr.main_sta_timetable(os.path.join(DATA_PATH, 'data_v3.json'), 
-                                          os.path.join(DATA_PATH, 'data.json'), 
-                                          DATABASE_PATH, 
-                                          default_station, 
-                                          route_name)
+        timetable = mtr.get_sta_timetable(snapshot.data_v3, snapshot.data,
+                                          default_station, route_name, STATION_TEMPLATE,
+                                          snapshot.station_timetable)
         
         if timetable is None:
-            return jsonify({'error': '未找到该线路信息'})
+            return _error(ERR_ROUTE_NOT_FOUND)
         elif timetable is False:
-            return jsonify({'error': '该线路无列车数据'})
+            return _error(ERR_ROUTE_NO_TRAIN)
         
-        return jsonify({
+        return {
             'route': route_name,
             'trains': '线路列车数据加载成功'
-        })
+        }
     except FileNotFoundError as e:
         return jsonify({'error': f'数据文件未找到: {str(e)}'})
     except Exception as e:
         return jsonify({'error': str(e)})
 
 @app.route('/train', methods=['POST'])
+@etagged
+@cached('long')
 def train_query():
     station_name = request.form.get('station_name')
     train_id = request.form.get('train_id')
     if not station_name or not train_id:
-        return jsonify({'error': '请输入车站名称和列车ID'})
+        return _error(ERR_NO_TRAIN_ARGS)
     
     try:
-        # 加载数据
-        with open(os.path.join(DATA_PATH, 'data.json'), 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 加载列车时刻表数据
-        with open(os.path.join(DATABASE_PATH, 'train_timetable_data.dat'), 'rb') as f:
-            train_timetable = pickle.load(f)
-        
-        # 加载车站时刻表数据
-        with open(os.path.join(DATABASE_PATH, 'station_timetable_data.dat'), 'rb') as f:
-            station_timetable = pickle.load(f)
-        
         # 获取列车信息
-        train_info = mtr.get_train(data, station_name, int(train_id), 
-                                   station_timetable, train_timetable)
+        train_info = _current().train(station_name, int(train_id))
         
         if train_info is None:
-            return jsonify({'error': '未找到该车站信息'})
+            return _error(ERR_STATION_NOT_FOUND)
         elif train_info is False:
-            return jsonify({'error': '未找到该列车信息'})
+            return _error(ERR_TRAIN_NOT_FOUND)
         
         route_name, stations, status = train_info
         
         # 格式化车站信息
-        formatted_stations = []
-        for station in stations:
-            formatted_stations.append({
-                'name': station[0],
-                'arrival': station[1],
-                'departure': station[2],
-                'id': station[3]
-            })
+        formatted_stations = _format_schedule(stations)
         
-        return jsonify({
+        return {
             'train_id': train_id,
             'station': station_name,
             'route': route_name,
             'status': status,
             'schedule': formatted_stations
-        })
+        }
     except FileNotFoundError as e:
         return jsonify({'error': f'数据文件未找到: {str(e)}'})
     except Exception as e:
@@ -161,28 +414,15 @@ def train_query():
 @app.route('/random_train')
 def random_train():
     try:
-        # 加载数据
-        with open(os.path.join(DATA_PATH, 'data.json'), 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # 加载列车时刻表数据
-        with open(os.path.join(DATABASE_PATH, 'train_timetable_data.dat'), 'rb') as f:
-            train_timetable = pickle.load(f)
+        snapshot = _current()
         
         # 获取随机列车信息
-        train_info = mtr.random_train(data, train_timetable)
+        train_info = mtr.random_train(snapshot.data, snapshot.train_timetable)
         
         route_name, stations, status = train_info
         
         # 格式化车站信息
-        formatted_stations = []
-        for station in stations:
-            formatted_stations.append({
-                'name': station[0],
-                'arrival': station[1],
-                'departure': station[2],
-                'id': station[3]
-            })
+        formatted_stations = _format_schedule(stations)
         
         return jsonify({
             'route': route_name,
@@ -195,4 +435,5 @@ def random_train():
         return jsonify({'error': str(e)})
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # 仅用于本地开发，生产环境请通过wsgi.py使用gunicorn等WSGI服务器部署
+    app.run(debug=bool(os.environ.get('FLASK_DEV')))
@@ -4,21 +4,60 @@ Generate station departures and train timetables for Minecraft Transit Railway.
 '''
 
 # 导入必要的模块
-from datetime import datetime, timedelta, timezone  # 用于处理日期和时间
+from concurrent.futures import ThreadPoolExecutor  # 用于同时写入多个文件
 from difflib import SequenceMatcher  # 用于字符串相似度比较
+from functools import lru_cache  # 用于缓存函数结果
+from itertools import chain, repeat  # 用于展开嵌套列表和批量生成发车数据
 from statistics import mode  # 用于计算众数
+import bisect  # 用于在有序列表中查找
+import heapq  # 用于查找最小的若干个元素
 import json  # 用于处理JSON数据
+import mmap  # 用于内存映射读取数据文件
+import os  # 用于获取文件修改时间
 import pickle  # 用于序列化和反序列化Python对象
 import random  # 用于生成随机数
+import sys  # 用于驻留重复出现的字符串
+import time  # 用于获取当前时间
 
 from opencc import OpenCC  # 用于中文简繁转换
 
+try:
+    from rapidfuzz import fuzz, process  # 可选依赖，安装后用于加速模糊匹配
+except ImportError:
+    process = None
+
+try:
+    import orjson  # 可选依赖，安装后用于加速JSON解析
+except ImportError:
+    orjson = None
+
 # 创建OpenCC实例，用于不同方向的中文转换
 tt_opencc1 = OpenCC('s2t')  # 简体转繁体
 tt_opencc2 = OpenCC('t2jp')  # 繁体转日语汉字
 tt_opencc3 = OpenCC('t2s')  # 繁体转简体
 tt_opencc4 = OpenCC('jp2t')  # 日语汉字转繁体
 
+
+# 车站和线路名称的数量有限，缓存转换结果，重复的名称不必再经过OpenCC
+@lru_cache(maxsize=65536)
+def _s2t(text: str) -> str:
+    return tt_opencc1.convert(text)
+
+
+@lru_cache(maxsize=65536)
+def _t2jp(text: str) -> str:
+    return tt_opencc2.convert(text)
+
+
+@lru_cache(maxsize=65536)
+def _t2s(text: str) -> str:
+    return tt_opencc3.convert(text)
+
+
+@lru_cache(maxsize=65536)
+def _jp2s(text: str) -> str:
+    return tt_opencc3.convert(tt_opencc4.convert(text))
+
 # 列车类型注释
 # 区间快速 - 西武池袋快速 #00CCFF
 # 快速 - 京王调布快速 #0F4E8C
@@ -68,23 +107,41 @@ def route_name_to_id(data: dict, route_name: str) -> list[str]:
     Returns:
         包含线路ID的列表
     '''
+    ids, names = _route_name_index(data)
     # 首先检查线路名称是否直接匹配线路ID
-    for route in data[0]['routes']:
-        if route_name == route['id']:
-            return [route_name]
+    if route_name in ids:
+        return [route_name]
 
     # 将线路名称转换为小写，用于不区分大小写的比较
-    route_name = route_name.lower()
-    result = []
+    return list(names.get(route_name.lower(), []))
+
+
+def _route_name_index(data: dict) -> tuple[set, dict]:
+    '''
+    获取线路名称索引，首次使用时构建并保存在数据字典中
+    
+    Args:
+        data: 包含线路信息的数据字典（v3格式）
+        
+    Returns:
+        (所有线路ID的集合, 小写名称 -> 线路ID列表的字典)的元组
+    '''
+    index = data[0].get('_route_name_index')
+    if index is not None:
+        return index
+
+    ids = set()  # 所有线路ID
+    names = {}  # 线路名称的各种形式 -> 线路ID列表
     
     # 遍历所有线路
     for route in data[0]['routes']:
         output: str = route['id']  # 线路ID
         n: str = route['name']  # 线路名称
         number: str = route['number']  # 线路编号
+        ids.add(output)
         
         # 构建可能的线路名称列表
-        route_names = [n, n.split('|')[0]]  # 完整名称和第一个部分
+        route_names = [n, n.partition('|')[0]]  # 完整名称和第一个部分
         
         # 处理包含英文名称的情况
         if ('||' in n and n.count('|') > 2) or \
@@ -98,30 +155,20 @@ def route_name_to_id(data: dict, route_name: str) -> list[str]:
             for tmp_name in route_names[1:]:
                 route_names.append(tmp_name + ' ' + number)
 
-        # 检查每个可能的名称是否匹配
+        # 每个可能的名称匹配时添加一次线路ID
         for x in route_names:
             x = x.lower().strip()  # 转换为小写并去除空格
-            if x == route_name:
-                result.append(output)
-                continue
-
-            # 跳过纯ASCII字符的名称（可能是英文）
-            if x.isascii():
-                continue
-
-            # 尝试将繁体转换为简体进行匹配
-            simp1 = tt_opencc3.convert(x)  # 繁体转简体
-            if simp1 == route_name:
-                result.append(output)
-                continue
+            forms = {x}
+            # 非纯ASCII字符的名称，同时尝试繁体转简体、日语汉字转繁体再转简体
+            if not x.isascii():
+                forms.add(_t2s(x))
+                forms.add(_jp2s(x))
 
-            # 尝试将日语汉字转换为繁体再转简体进行匹配
-            simp2 = tt_opencc3.convert(tt_opencc4.convert(x))  # 日语汉字转繁体再转简体
-            if simp2 == route_name:
-                result.append(output)
-                continue
+            for form in forms:
+                names.setdefault(form, []).append(output)
 
-    return result
+    index = data[0]['_route_name_index'] = (ids, names)
+    return index
 
 
 def get_close_matches(words, possibilities, cutoff=0.2):
@@ -136,9 +183,33 @@ def get_close_matches(words, possibilities, cutoff=0.2):
     Returns:
         最相似的匹配项的ID
     '''
-    # 初始化结果列表，包含一个默认值(-1, None)
-    result = [(-1, None)]
+    # 目前相似度最高的结果(相似度, ID)，默认值为(-1, None)
+    best = (-1, None)
     s = SequenceMatcher()  # 创建SequenceMatcher实例用于计算字符串相似度
+
+    if process is not None:
+        # rapidfuzz的ratio基于最长公共子序列，不小于SequenceMatcher的相似度，
+        # 可以作为上界：按上界从高到低计算实际相似度，上界低于已有的最佳结果时停止
+        # 两者的浮点误差不同，比较时留出一点余量
+        names = [x for x, _ in possibilities]
+        for word in words:
+            s.set_seq2(word)
+            for x, bound, i in process.extract(word, names, scorer=fuzz.ratio,
+                                               score_cutoff=cutoff * 100 - 1e-6,
+                                               limit=None):
+                if bound < max(cutoff, best[0]) * 100 - 1e-6:
+                    break
+
+                s.set_seq1(x)
+                ratio = s.ratio()
+                if ratio >= cutoff:
+                    best = max(best, (ratio, possibilities[i][1]))
+
+        return best[1]
+    
+    # 快速检查的阈值，找到更好的结果后随之提高，
+    # 相似度上界低于已有最佳结果的匹配项不可能胜出，无需计算实际相似度
+    threshold = cutoff
     
     # 遍历每个要匹配的单词
     for word in words:
@@ -149,16 +220,19 @@ def get_close_matches(words, possibilities, cutoff=0.2):
             s.set_seq1(x)  # 设置第一个序列为当前可能的匹配项
             
             # 快速检查相似度，提高性能
-            if s.real_quick_ratio() >= cutoff and \
-                    s.quick_ratio() >= cutoff:
+            if s.real_quick_ratio() >= threshold and \
+                    s.quick_ratio() >= threshold:
                 # 计算实际相似度
                 ratio = s.ratio()
                 if ratio >= cutoff:
-                    # 添加到结果列表
-                    result.append((ratio, y))
+                    best = max(best, (ratio, y))
+                    threshold = max(threshold, ratio)
 
     # 返回相似度最高的匹配项的ID
-    return max(result)[1]
+    return best[1]
+
+
+_FUZZY_CACHE_SIZE = 4096  # 每份数据最多保存的模糊匹配结果数
 
 
 def station_name_to_id(data: dict, sta: str,
@@ -176,40 +250,74 @@ def station_name_to_id(data: dict, sta: str,
     '''
     # 将车站名称转换为小写，用于不区分大小写的比较
     sta = sta.lower()
-    # 尝试不同的中文转换形式
-    tra1 = tt_opencc1.convert(sta)  # 简体转繁体
-    sta_try = [sta, tra1, tt_opencc2.convert(tra1)]  # 原始、繁体、日语汉字形式
+    if sta.isascii():
+        # 纯ASCII的名称转换后不变，只需尝试原始形式
+        sta_try = [sta]
+    else:
+        # 尝试不同的中文转换形式，去掉转换后相同的重复项
+        tra1 = _s2t(sta)  # 简体转繁体
+        sta_try = list(dict.fromkeys([sta, tra1, _t2jp(tra1)]))  # 原始、繁体、日语汉字形式
+
+    names, all_names = _station_name_index(data)
+    # 检查是否匹配任何形式的车站名称，多个车站匹配时取最后一个
+    hits = [names[st] for st in sta_try if st in names]
+    if hits:
+        return max(hits)[1]
+
+    # 如果未找到车站且启用模糊匹配，尝试模糊匹配
+    if fuzzy_compare is True:
+        # 模糊匹配的结果保存在数据字典中，相同的名称不再重复匹配
+        matches = data.setdefault('_station_fuzzy_matches', {})
+        try:
+            return matches[sta]
+        except KeyError:
+            pass
 
+        if len(matches) >= _FUZZY_CACHE_SIZE:
+            matches.clear()
+
+        result = matches[sta] = get_close_matches(sta_try, all_names)
+        return result
+
+    return None
+
+
+def _station_name_index(data: dict) -> tuple[dict, list]:
+    '''
+    获取车站名称索引，首次使用时构建并保存在数据字典中
+    
+    Args:
+        data: 包含车站信息的数据字典
+        
+    Returns:
+        (小写名称 -> (车站序号, 车站ID)的字典, 用于模糊匹配的(名称, 车站ID)列表)的元组
+    '''
+    index = data.get('_station_name_index')
+    if index is not None:
+        return index
+
+    names = {}  # 车站名称的各种形式 -> (车站序号, 车站ID)
     all_names = []  # 用于模糊匹配的所有车站名称列表
-    stations = data['stations']  # 获取所有车站
-    output = None  # 输出结果
-    has_station = False  # 是否找到车站
     
     # 遍历所有车站
-    for station_id, station_dict in stations.items():
+    for n, (station_id, station_dict) in enumerate(data['stations'].items()):
         s_1 = station_dict['name']  # 车站全名
         # 如果车站有坐标信息，添加到模糊匹配列表
         if 'x' in station_dict and 'z' in station_dict:
             all_names.append((s_1, station_id))
 
         # 提取车站名称的不同部分
-        s_split = station_dict['name'].split('|')
+        s_split = s_1.split('|')
         s_2_2 = s_split[-1]  # 最后一个部分
         s_2 = s_2_2.split('/')[-1]  # 最后一个部分的最后一个子部分
         s_3 = s_split[0]  # 第一个部分
         
-        # 检查是否匹配任何形式的车站名称
-        for st in sta_try:
-            if st in (s_1.lower(), s_2.lower(), s_2_2.lower(), s_3.lower()):
-                has_station = True
-                output = station_id
-                break
+        # 同名的车站由后面的覆盖，与逐个遍历时的结果一致
+        for name in (s_1, s_2, s_2_2, s_3):
+            names[name.lower()] = (n, station_id)
 
-    # 如果未找到车站且启用模糊匹配，尝试模糊匹配
-    if has_station is False and fuzzy_compare is True:
-        output = get_close_matches(sta_try, all_names)
-
-    return output
+    index = data['_station_name_index'] = (names, all_names)
+    return index
 
 
 def station_short_id_to_id(data: dict, short_id: int) -> str:
@@ -223,18 +331,66 @@ def station_short_id_to_id(data: dict, short_id: int) -> str:
     Returns:
         车站ID，如果未找到则返回None
     '''
-    # 将短ID转换为十六进制字符串（去除'0x'前缀）
-    short_id = hex(short_id)[2:]
-    stations = data['stations']  # 获取所有车站
-    output = None  # 输出结果
+    index = data.get('_short_id_index')
+    if index is None:
+        # 首次使用时构建短ID（十六进制字符串转为整数）索引，多个车站短ID相同时取第一个
+        index = {}
+        for station_id, station_dict in data['stations'].items():
+            index.setdefault(int(station_dict['station'], 16), station_id)
+
+        data['_short_id_index'] = index
+
+    return index.get(short_id)
+
+
+def _route_station_positions(data: dict) -> dict[str, dict[str, int]]:
+    '''
+    获取每条线路上各车站的位置，首次使用时构建并保存在数据字典中
     
-    # 遍历所有车站，查找匹配的短ID
-    for station_id, station_dict in stations.items():
-        if short_id == station_dict['station']:
-            output = station_id
-            break
+    Args:
+        data: 包含车站和线路信息的数据字典
+        
+    Returns:
+        线路ID -> {车站ID: 车站在线路中的索引}的字典
+    '''
+    positions = data.get('_route_station_positions')
+    if positions is None:
+        positions = {}
+        for route_id, route in data['routes'].items():
+            route_positions = positions[route_id] = {}
+            for i, sta in enumerate(route['stations']):
+                # 车站在线路中出现多次时取第一次，与list.index一致
+                route_positions.setdefault(sta['id'], i)
 
-    return output
+        data['_route_station_positions'] = positions
+
+    return positions
+
+
+def _display_names(data: dict) -> tuple[dict, dict]:
+    '''
+    获取车站和线路的显示名称，首次使用时构建并保存在数据字典中
+    
+    Args:
+        data: 包含车站和线路信息的数据字典
+        
+    Returns:
+        (车站ID -> 车站名称, 线路ID -> 格式化的线路名称)的元组
+    '''
+    names = data.get('_display_names')
+    if names is None:
+        station_names = {station_id: station['name'].partition('|')[0]
+                         for station_id, station in data['stations'].items()}
+        route_names = {route_id: route['name'].replace('||', ' ').replace('|', ' ')
+                       for route_id, route in data['routes'].items()}
+        names = data['_display_names'] = (station_names, route_names)
+
+    return names
+
+
+# 时间字符串查找表：一天中每分钟的'HH:MM'，以及每秒的':SS'后缀
+_HOUR_MINUTE = [f'{m // 60:02d}:{m % 60:02d}' for m in range(24 * 60)]
+_SECOND = [f':{x:02d}' for x in range(60)]
 
 
 def convert_time(t, use_second=False):
@@ -248,37 +404,26 @@ def convert_time(t, use_second=False):
     Returns:
         格式化的时间字符串
     '''
+    if type(t) is int and 0 <= t < 86400:
+        # 一天之内的时间直接查表
+        if use_second is True:
+            return _HOUR_MINUTE[t // 60] + _SECOND[t % 60]
+        return _HOUR_MINUTE[t // 60]
+
+    # 计算小时、分钟和秒（分钟和秒不会超过60，无需进位）
+    hour, rest = divmod(t, 60 * 60)
+    minute, second = divmod(rest, 60)
     if use_second is True:
-        # 计算小时、分钟和秒
-        hour = str(t // (60 * 60)).rjust(2, '0')  # 小时，补零到2位
-        minute = str((t % 3600) // 60).rjust(2, '0')  # 分钟，补零到2位
-        second = str(t % 60).rjust(2, '0')  # 秒，补零到2位
-        result = ':'.join([hour, minute, second])  # 组合成时间字符串
+        parts = (hour, minute, second)
     else:
-        # 计算小时、分钟
-        hour = t // (60 * 60)  # 小时
-        minute = (t % 3600) // 60  # 分钟
-        second = t % 60  # 秒
-        
-        # 处理秒数超过60的情况
-        if second >= 60:
-            minute += 1
-        
-        # 处理分钟超过60的情况
-        if minute >= 60:
-            minute -= 60
-            hour += 1
-        
         # 处理小时为24的情况（转换为0）
         if hour == 24:
             hour = 0
-        
-        # 转换为字符串并补零
-        hour = str(hour).rjust(2, '0')  # 小时，补零到2位
-        minute = str(minute).rjust(2, '0')  # 分钟，补零到2位
-        result = ':'.join([hour, minute])  # 组合成时间字符串
 
-    return result
+        parts = (hour, minute)
+
+    # 转换为字符串并补零到2位，组合成时间字符串
+    return ':'.join(str(x).rjust(2, '0') for x in parts)
 
 
 def get_timetable(data, dep_data, station_name, route_name, use_second=False):
@@ -302,11 +447,13 @@ def get_timetable(data, dep_data, station_name, route_name, use_second=False):
     # 按时间排序
     data.sort(key=lambda x: x[1])
     output = []
+    seen = set()  # 已添加的时间
     
     # 遍历发车数据，转换时间格式并去重
     for d in data:
         result = convert_time(d[1], use_second)  # 转换时间格式
-        if result not in output:  # 去重
+        if result not in seen:  # 去重
+            seen.add(result)
             output.append((d[0], result))  # 添加到输出列表
 
     return output
@@ -350,10 +497,9 @@ def get_train(data, station, train_id: int,
 
     # 获取列车的详细时刻表
     train: list = train_tt[route_id][i]
-    all_stations = data['stations']  # 所有车站信息
     route_data = data['routes'][route_id]  # 线路信息
-    route_name: str = route_data['name']  # 线路名称
-    route_name = route_name.replace('||', ' ').replace('|', ' ')  # 格式化线路名称
+    station_names, route_names = _display_names(data)  # 车站和线路的显示名称
+    route_name = route_names[route_id]  # 格式化的线路名称
     route_stations = route_data['stations']  # 线路经过的车站
 
     # 转换时间格式
@@ -369,9 +515,8 @@ def get_train(data, station, train_id: int,
             t1 = None
         else:
             try:
-                # 获取到达时间并从列表中移除
-                t1 = timetable.pop(0)
-                train.pop(0)
+                # 获取到达时间
+                t1 = timetable[2 * i - 1]
             except IndexError:
                 # 如果列表为空，继续下一个车站
                 continue
@@ -382,9 +527,9 @@ def get_train(data, station, train_id: int,
             _t2 = None
         else:
             try:
-                # 获取发车时间并从列表中移除
-                t2 = timetable.pop(0)
-                _t2 = train.pop(0)
+                # 获取发车时间
+                t2 = timetable[2 * i]
+                _t2 = train[2 * i]
             except IndexError:
                 # 如果列表为空，继续下一个车站
                 continue
@@ -392,16 +537,100 @@ def get_train(data, station, train_id: int,
         # 检查是否为当前列车的停站
         if _t2 is not None and _t2 % 86400 == dep % 86400:
             # 停站
-            msg = (all_stations[x['id']]['name'].split('|')[0], )
+            msg = (station_names[x['id']], )
 
-        # 获取车站名称并添加到输出列表
-        station_name = all_stations[x['id']]['name']
-        output.append((station_name.split('|')[0], t1, t2, x['id']))
+        # 添加车站信息到输出列表
+        output.append((station_names[x['id']], t1, t2, x['id']))
 
     # 返回线路名称、车站列表和状态信息
     return route_name, output, msg
 
 
+_TIME_BUCKET = 600  # 列车时间索引中每个时间段的长度（秒）
+_train_index_cache = (None, None)  # (列车时刻表数据, 时间索引)
+
+
+def _train_time_index(trains: dict[str, list]) -> list[list[tuple]]:
+    '''
+    按时间段索引每辆列车的运行区间，同一份列车时刻表数据只构建一次
+    
+    Args:
+        trains: 列车时刻表数据
+        
+    Returns:
+        时间段 -> [(线路ID, 列车, 最早时间, 最晚时间, 权重), ...]的列表
+    '''
+    global _train_index_cache
+    cached_trains, index = _train_index_cache
+    if cached_trains is trains:
+        return index
+
+    # 列车时间可能超过一天，索引覆盖两天
+    index = [[] for _ in range(2 * 86400 // _TIME_BUCKET)]
+    for route_id, route_trains in trains.items():
+        if len(route_trains) == 0:
+            continue
+
+        # 先随机选择线路再随机选择列车，每辆列车的概率与线路的列车数成反比
+        weight = 1 / len(route_trains)
+        for train in route_trains:
+            if len(train) == 0:
+                continue  # 跳过无时刻表的列车
+
+            first, last = min(train), max(train)
+            entry = (route_id, train, first, last, weight)
+            start = max(first // _TIME_BUCKET, 0)
+            end = min(last // _TIME_BUCKET, len(index) - 1)
+            for i in range(start, end + 1):
+                index[i].append(entry)
+
+    _train_index_cache = (trains, index)
+    return index
+
+
+def _current_time(tz: int) -> int:
+    '''
+    获取指定时区的当前时间
+    
+    Args:
+        tz: 时区（小时）
+        
+    Returns:
+        当前时间（秒），取模24小时后即为当天的秒数
+    '''
+    return round(time.time()) + tz * 60 * 60
+
+
+def _running_trains(trains: dict[str, list], departure_time: int,
+                    route_ids: set[str] = None) -> list[tuple]:
+    '''
+    查找在指定时间运行中的列车
+    
+    Args:
+        trains: 列车时刻表数据
+        departure_time: 当天的时间（秒）
+        route_ids: 只查找这些线路的列车，默认为所有线路
+        
+    Returns:
+        (线路ID, 列车, 权重)的列表
+    '''
+    index = _train_time_index(trains)
+    result = []
+    for t in (departure_time, departure_time + 86400):
+        for route_id, train, first, last, weight in index[t // _TIME_BUCKET]:
+            if not first <= t <= last:
+                continue
+
+            # 跨越两天的列车只计算一次
+            if t != departure_time and first <= departure_time <= last:
+                continue
+
+            if route_ids is None or route_id in route_ids:
+                result.append((route_id, train, weight))
+
+    return result
+
+
 def route_random_train(data_v3, data, route, trains: dict[str, list],
                        departure_time: int = None):
     '''
@@ -422,59 +651,31 @@ def route_random_train(data_v3, data, route, trains: dict[str, list],
     if route_id == []:
         return None
 
-    all_stations = data['stations']  # 所有车站信息
     tz = 8  # 时区（+8）
     
     # 如果未指定发车时间，使用当前时间
     if departure_time is None:
-        dtz = timezone(timedelta(hours=tz))  # 创建时区对象
-        t1 = datetime.now().replace(year=1970, month=1, day=1)  # 创建当前时间对象（1970年基准）
-        try:
-            t1 = t1.astimezone(dtz).replace(tzinfo=timezone.utc)  # 转换时区
-        except OSError:
-            t1 = t1.replace(tzinfo=timezone.utc)  # 处理时区转换失败的情况
-
-        departure_time = round(t1.timestamp())  # 转换为时间戳
+        departure_time = _current_time(tz)
 
     departure_time %= 86400  # 取模24小时
 
-    # 构建线路和列车的列表
-    all_trains = [(x, trains[x]) for x in route_id if x in trains]
-    train = [-1]  # 初始列车值
-    tries = 3000  # 尝试次数
-    
-    # 尝试找到符合时间条件的列车
-    while (departure_time < min(train) or departure_time > max(train)) and \
-            (departure_time + 86400 < min(train) or
-             departure_time + 86400 > max(train)):
-        route = random.choice(all_trains)  # 随机选择线路
-        if len(route[1]) == 0:
-            continue  # 跳过无列车的线路
-
-        train = random.choice(route[1])  # 随机选择列车
-        route_data = data['routes'][route[0]]  # 线路信息
-        tries -= 1
-        if tries == 0:
-            break  # 达到最大尝试次数
-
-        if len(train) == 0:
-            continue  # 跳过无时刻表的列车
-
-    # 如果未找到符合条件的列车，随机选择一个
-    if train == [-1]:
-        route = [0, 0]
-        tries = 1000
-        while len(route[1]) == 0 or len(train) == 0:
-            route = random.choice(all_trains)
-            train = random.choice(route)
-            route_data = data['routes'][route[0]]
-            tries -= 1
-            if tries == 0:
-                break
+    # 在该线路运行中的列车里随机选择一辆
+    candidates = _running_trains(trains, departure_time, set(route_id))
+    if candidates:
+        route, train, _ = random.choices(
+            candidates, [x[2] for x in candidates])[0]
+    else:
+        # 没有运行中的列车，随机选择一辆
+        all_trains = [(x, trains[x]) for x in route_id
+                      if len(trains.get(x, [])) > 0]
+        route, route_trains = random.choice(all_trains)
+        train = random.choice(route_trains)
+
+    route_data = data['routes'][route]  # 线路信息
 
     # 处理线路名称和车站
-    route_name: str = route_data['name']
-    route_name = route_name.replace('||', ' ').replace('|', ' ')  # 格式化线路名称
+    station_names, route_names = _display_names(data)  # 车站和线路的显示名称
+    route_name = route_names[route]  # 格式化的线路名称
     route_stations = route_data['stations']  # 线路经过的车站
 
     # 转换时间格式
@@ -490,18 +691,17 @@ def route_random_train(data_v3, data, route, trains: dict[str, list],
             t1 = None
             _t1 = None
         else:
-            # 获取到达时间
-            t1 = timetable.pop(0)
-            _t1 = train.pop(0)
+            # 获取到达时间（时刻表依次为各站的到达、发车时间，首站只有发车时间）
+            t1 = timetable[2 * i - 1]
+            _t1 = train[2 * i - 1]
 
         # 检查列车是否在运行中
         if _t1 is not None and _t2 is not None and \
                 (_t2 <= departure_time <= _t1 or
                  _t2 <= departure_time + 86400 <= _t1):
             # 运行中
-            last_id = all_stations[route_stations[i - 1]['id']]
-            msg = ((last_id['name'].split('|')[0],
-                    all_stations[x['id']]['name'].split('|')[0]))
+            msg = ((station_names[route_stations[i - 1]['id']],
+                    station_names[x['id']]))
 
         if i == len(route_stations) - 1:
             # 最后一个车站，没有发车时间
@@ -509,19 +709,18 @@ def route_random_train(data_v3, data, route, trains: dict[str, list],
             _t2 = None
         else:
             # 获取发车时间
-            t2 = timetable.pop(0)
-            _t2 = train.pop(0)
+            t2 = timetable[2 * i]
+            _t2 = train[2 * i]
 
         # 检查列车是否在站内
         if _t1 is not None and _t2 is not None and \
                 (_t1 < departure_time < _t2 or
                  _t1 < departure_time + 86400 < _t2):
             # 停站
-            msg = (all_stations[x['id']]['name'].split('|')[0], )
+            msg = (station_names[x['id']], )
 
         # 添加车站信息到输出列表
-        station_name = all_stations[x['id']]['name']
-        output.append((station_name.split('|')[0], t1, t2, x['id']))
+        output.append((station_names[x['id']], t1, t2, x['id']))
 
     # 返回线路名称、车站列表和状态信息
     return route_name, output, msg
@@ -539,47 +738,32 @@ def random_train(data, trains: dict[str, list], departure_time: int = None):
     Returns:
         包含线路名称、车站列表和状态信息的元组
     '''
-    all_stations = data['stations']  # 所有车站信息
     tz = 8  # 时区（+8）
     
     # 如果未指定发车时间，使用当前时间
     if departure_time is None:
-        dtz = timezone(timedelta(hours=tz))  # 创建时区对象
-        t1 = datetime.now().replace(year=1970, month=1, day=1)  # 创建当前时间对象（1970年基准）
-        try:
-            t1 = t1.astimezone(dtz).replace(tzinfo=timezone.utc)  # 转换时区
-        except OSError:
-            t1 = t1.replace(tzinfo=timezone.utc)  # 处理时区转换失败的情况
-
-        departure_time = round(t1.timestamp())  # 转换为时间戳
+        departure_time = _current_time(tz)
 
     departure_time %= 86400  # 取模24小时
 
-    # 构建列车列表
-    all_trains = list(trains.items())
-    train = [-1]  # 初始列车值
-    tries = 3000  # 尝试次数
-    
-    # 尝试找到符合时间条件的列车
-    while (departure_time < min(train) or departure_time > max(train)) and \
-            (departure_time + 86400 < min(train) or
-             departure_time + 86400 > max(train)):
-        route = random.choice(all_trains)  # 随机选择线路
-        if len(route[1]) == 0:
-            continue  # 跳过无列车的线路
-
-        route_data = data['routes'][route[0]]  # 线路信息
-        if route_data['hidden'] is True:
-            continue  # 跳过隐藏的线路
+    # 在运行中的列车里随机选择一辆，跳过隐藏的线路
+    candidates = [x for x in _running_trains(trains, departure_time)
+                  if data['routes'][x[0]]['hidden'] is not True]
+    if candidates:
+        route_id, train, _ = random.choices(
+            candidates, [x[2] for x in candidates])[0]
+    else:
+        # 没有运行中的列车，随机选择一辆
+        all_trains = [(x, y) for x, y in trains.items()
+                      if len(y) > 0 and data['routes'][x]['hidden'] is not True]
+        route_id, route_trains = random.choice(all_trains)
+        train = random.choice(route_trains)
 
-        train = random.choice(route[1])  # 随机选择列车
-        tries -= 1
-        if tries == 0:
-            break  # 达到最大尝试次数
+    route_data = data['routes'][route_id]  # 线路信息
 
     # 处理线路名称和车站
-    route_name: str = route_data['name']
-    route_name = route_name.replace('||', ' ').replace('|', ' ')  # 格式化线路名称
+    station_names, route_names = _display_names(data)  # 车站和线路的显示名称
+    route_name = route_names[route_id]  # 格式化的线路名称
     route_stations = route_data['stations']  # 线路经过的车站
 
     # 转换时间格式
@@ -595,18 +779,17 @@ def random_train(data, trains: dict[str, list], departure_time: int = None):
             t1 = None
             _t1 = None
         else:
-            # 获取到达时间
-            t1 = timetable.pop(0)
-            _t1 = train.pop(0)
+            # 获取到达时间（时刻表依次为各站的到达、发车时间，首站只有发车时间）
+            t1 = timetable[2 * i - 1]
+            _t1 = train[2 * i - 1]
 
         # 检查列车是否在运行中
         if _t1 is not None and _t2 is not None and \
                 (_t2 <= departure_time <= _t1 or
                  _t2 <= departure_time + 86400 <= _t1):
             # 运行中
-            last_id = all_stations[route_stations[i - 1]['id']]
-            msg = ((last_id['name'].split('|')[0],
-                    all_stations[x['id']]['name'].split('|')[0]))
+            msg = ((station_names[route_stations[i - 1]['id']],
+                    station_names[x['id']]))
 
         if i == len(route_stations) - 1:
             # 最后一个车站，没有发车时间
@@ -614,24 +797,61 @@ def random_train(data, trains: dict[str, list], departure_time: int = None):
             _t2 = None
         else:
             # 获取发车时间
-            t2 = timetable.pop(0)
-            _t2 = train.pop(0)
+            t2 = timetable[2 * i]
+            _t2 = train[2 * i]
 
         # 检查列车是否在站内
         if _t1 is not None and _t2 is not None and \
                 (_t1 < departure_time < _t2 or
                  _t1 < departure_time + 86400 < _t2):
             # 停站
-            msg = (all_stations[x['id']]['name'].split('|')[0], )
+            msg = (station_names[x['id']], )
 
         # 添加车站信息到输出列表
-        station_name = all_stations[x['id']]['name']
-        output.append((station_name.split('|')[0], t1, t2, x['id']))
+        output.append((station_names[x['id']], t1, t2, x['id']))
 
     # 返回线路名称、车站列表和状态信息
     return route_name, output, msg
 
 
+_station_departures_cache = (None, None, {})  # (车站时刻表数据, 车站和线路数据, 车站ID -> 发车列表)
+
+
+def _station_departures(data, station_tt: dict[str, dict[str, tuple]],
+                        station_id: str) -> list[tuple[str, list]]:
+    '''
+    获取车站每条线路按时间排序的发车列表，同一份数据中每个车站只构建一次
+    
+    Args:
+        data: 包含车站和线路信息的数据字典
+        station_tt: 车站时刻表数据
+        station_id: 车站ID
+        
+    Returns:
+        按线路名称排序的[(线路ID, [(发车时间, 列车ID, 序号), ...]), ...]列表
+    '''
+    global _station_departures_cache
+    cached_tt, cached_data, cache = _station_departures_cache
+    if cached_tt is not station_tt or cached_data is not data:
+        cache = {}
+        _station_departures_cache = (station_tt, data, cache)
+
+    departures = cache.get(station_id)
+    if departures is not None:
+        return departures
+
+    dep_dict: dict[str, list] = {}  # 发车数据字典
+    for train_id, (route_id, i, dep) in station_tt[station_id].items():
+        dep_dict.setdefault(route_id, []).append((dep, train_id, i))
+
+    # 按线路名称排序
+    all_routes = data['routes']  # 所有线路信息
+    departures = sorted(((route_id, sorted(x)) for route_id, x in dep_dict.items()),
+                        key=lambda x: all_routes[x[0]]['name'])
+    cache[station_id] = departures
+    return departures
+
+
 def get_text_timetable(data, station, departure_time: int,
                        station_tt: dict[str, dict[str, tuple]]):
     '''
@@ -659,55 +879,72 @@ def get_text_timetable(data, station, departure_time: int,
     if station_id is None:
         return None
 
-    output = ''  # 输出字符串
-    dep_dict: dict[str, list] = {}  # 发车数据字典
+    lines = []  # 输出的每一行
+    station_names, route_names = _display_names(data)  # 车站和线路的显示名称
     
-    # 遍历车站的所有列车
-    for train_id, (route_id, i, dep) in station_tt[station_id].items():
-        if route_id not in dep_dict:
-            dep_dict[route_id] = []
-
-        dep_dict[route_id].append((dep, train_id, i))  # 添加当前发车时间
-        dep_dict[route_id].append((dep + 86400, train_id, i))  # 添加次日发车时间
+    # 遍历每条线路（按线路名称排序）
+    for route_id, x in _station_departures(data, station_tt, station_id):
+        # 格式化的线路名称，转换为简体中文；其余内容都是ASCII字符，无需转换，
+        # 各线路名称的转换结果可以复用
+        route_name = _jp2s(route_names[route_id])
+        # 每条线路显示接下来的2个发车时间，不足2个时不显示；
+        # 发车时间已排序，当天和次日晚于当前时间的发车各取最早的两个即可
+        today = bisect.bisect_right(x, (departure_time, float('inf')))
+        tomorrow = bisect.bisect_right(x, (departure_time - 86400, float('inf')))
+        deps = heapq.nsmallest(2, x[today:today + 2] +
+                               [(dep + 86400, train_id, i)
+                                for dep, train_id, i in x[tomorrow:tomorrow + 2]])
+        if len(deps) < 2:
+            continue
 
-    # 按线路名称排序
-    k = list(dep_dict.items())
-    k.sort(key=lambda x: data['routes'][x[0]]['name'])
-    
-    # 遍历每条线路
-    for route_id, x in k:
-        x.sort()  # 按发车时间排序
-        route_data = data['routes'][route_id]  # 线路信息
-        route_name: str = route_data['name']  # 线路名称
-        route_name = route_name.replace('||', ' ').replace('|', ' ')  # 格式化线路名称
-        count = 1  # 计数
-        template = f'{route_name}: '  # 模板字符串
-        
-        # 遍历发车时间
-        for y in x:
-            dep = y[0]  # 发车时间
-            train_id = y[1]  # 列车ID
-            if dep > departure_time:
-                # 转换时间格式并添加到模板
-                dep_time = convert_time(dep % 86400, use_second=True)
-                template += f'{dep_time}({train_id}), '
-                count += 1
-                if count == 3:
-                    # 每条线路只显示3个发车时间
-                    template = template[:-2] + '\n'
-                    output += template
-                    break
+        # 转换时间格式并添加到输出
+        times = ', '.join(f'{convert_time(dep % 86400, use_second=True)}({train_id})'
+                          for dep, train_id, _ in deps)
+        lines.append(f'{route_name}: {times}\n')
 
     # 获取车站信息
     station_data = data['stations'][station_id]
-    original_station_name = station_data['name'].split('|')[0]  # 车站名称
+    original_station_name = station_names[station_id]  # 车站名称
     short_id = station_data['station']  # 车站短ID
-    short_id = int('0x' + str(short_id), 16)  # 转换为整数
+    short_id = int(short_id, 16)  # 转换为整数
     
-    # 构建结果字符串
-    result = f'{original_station_name}站 - ID: {short_id}\n{output}'
-    # 转换为简体中文
-    return tt_opencc3.convert(tt_opencc4.convert(result))
+    # 构建结果字符串，车站名称转换为简体中文
+    output = ''.join(lines)
+    return f'{_jp2s(original_station_name + "站")} - ID: {short_id}\n{output}'
+
+
+@lru_cache(maxsize=1)
+def _sorted_express_table() -> tuple[tuple[str, str], ...]:
+    '''按名称长度从长到短排列的列车类型映射表，优先匹配长的名称'''
+    return tuple(sorted(EXPRESS_TABLE.items(),
+                        key=lambda x: len(x[0]), reverse=True))
+
+
+@lru_cache(maxsize=4096)
+def route_express_level(route_name: str) -> tuple[str, str]:
+    '''
+    根据线路名称匹配列车类型，同一线路名称只匹配一次
+    
+    Args:
+        route_name: 线路名称
+        
+    Returns:
+        (列车颜色, 列车类型缩写)的元组，未匹配到时为('#000000', '')
+    '''
+    for name, level in _sorted_express_table():
+        if name in route_name:
+            color = COLOR_TABLE[level]  # 列车颜色
+            # 处理列车类型缩写
+            if len(level) == 2:
+                level = level[0]
+            elif len(level) == 3:
+                level = level[0] + level[1]
+            elif len(level) == 4:
+                level = level[0] + level[2]
+            return color, level
+
+    # 未匹配到列车类型
+    return '#000000', ''
 
 
 def get_sta_timetable(data_v3, data, station, routes, template_file,
@@ -755,15 +992,14 @@ def get_sta_timetable(data_v3, data, station, routes, template_file,
     all_stations = data['stations']  # 所有车站信息
     all_routes = data['routes']  # 所有线路信息
     short_id = all_stations[station_id]['station']  # 车站短ID
-    short_id = int('0x' + str(short_id), 16)  # 转换为整数
+    short_id = int(short_id, 16)  # 转换为整数
 
     # 读取HTML模板
-    with open(template_file, 'r', encoding='utf-8') as f:
-        html = f.read()
+    html = _load_text(template_file)
 
     # 获取车站名称和英文名称
     n: str = all_stations[station_id]['name']
-    station_name = n.split('|')[0]  # 车站名称
+    station_name = n.partition('|')[0]  # 车站名称
     if '|' in n:
         eng_name = n.split('|')[1].split('|')[0]  # 英文名称
     else:
@@ -772,23 +1008,24 @@ def get_sta_timetable(data_v3, data, station, routes, template_file,
     # 获取线路颜色和名称
     route_colors = [hex(all_routes[x]['color'])[2:].rjust(6, '0')
                     for x in route_ids]  # 线路颜色
-    route_names = [all_routes[x]['name'].split('|')[0] for x in route_ids]  # 线路名称
+    route_names = [all_routes[x]['name'].partition('|')[0] for x in route_ids]  # 线路名称
     route_names = list(set(route_names))  # 去重
     
     next_stations = []  # 下一站列表
     last_stations = {}  # 终点站映射
     
+    station_names, _ = _display_names(data)  # 车站的显示名称
+    positions = _route_station_positions(data)  # 各线路上车站的位置
+    
     # 遍历每条线路
     for x in route_ids:
-        station_ids: list[str] = [y['id'] for y in all_routes[x]['stations']]  # 线路经过的车站ID
-        stations_names: list[str] = [all_stations[y]['name']
-                                     for y in station_ids]  # 线路经过的车站名称
+        route_stations = all_routes[x]['stations']  # 线路经过的车站
         
-        if station_id in station_ids:
-            i = station_ids.index(station_id)  # 当前车站在线路中的索引
-            if i != len(station_ids) - 1:
-                next_station = stations_names[i + 1].split('|')[0]  # 下一站
-                last_station = stations_names[-1].split('|')[0]  # 终点站
+        i = positions[x].get(station_id)  # 当前车站在线路中的索引
+        if i is not None:
+            if i != len(route_stations) - 1:
+                next_station = station_names[route_stations[i + 1]['id']]  # 下一站
+                last_station = station_names[route_stations[-1]['id']]  # 终点站
                 tmp_sta = last_station
                 
                 # 处理包含WIP的终点站
@@ -814,13 +1051,8 @@ def get_sta_timetable(data_v3, data, station, routes, template_file,
                 # if last_station not in next_stations:
                 #     next_stations.append(last_station)
 
-    # 处理终点站映射
-    last_count = 0
-    last_sta_table = ''
-    for x, y in last_stations.items():
-        if x != y:
-            last_sta_table += f'...{y}={x}...\n'
-            last_count += 1
+    # 需要显示缩写说明的终点站数量（缩写与全名不同），用于计算图片高度
+    last_count = sum(1 for x, y in last_stations.items() if x != y)
 
     # 构建输出列表
     output = []
@@ -844,36 +1076,16 @@ def get_sta_timetable(data_v3, data, station, routes, template_file,
     output.sort(key=lambda x: x[1])
     last_hour = ''
     
-    # 处理列车类型
-    express_table = list(EXPRESS_TABLE.items())
-    express_table.sort(key=lambda x: len(x[0]), reverse=True)  # 按长度排序，优先匹配长的
     template = ''
     
     # 遍历列车
     for route_id, t, train_id in output:
         route_name = all_routes[route_id]['name']  # 线路名称
-        
-        # 匹配列车类型
-        for name, level in express_table:
-            if name in route_name:
-                color = COLOR_TABLE[level]  # 列车颜色
-                # 处理列车类型缩写
-                if len(level) == 2:
-                    level = level[0]
-                elif len(level) == 3:
-                    level = level[0] + level[1]
-                elif len(level) == 4:
-                    level = level[0] + level[2]
-                break
-        else:
-            # 未匹配到列车类型
-            color = '#000000'
-            level = ''
-
+        color, level = route_express_level(route_name)  # 匹配列车类型
         level += ' ' + str(train_id)  # 添加列车ID
         destination_id = all_routes[route_id]['stations'][-1]['id']  # 终点站ID
         destination: str = all_stations[destination_id]['name']  # 终点站名称
-        dest = last_stations[destination.split('|')[0]]  # 终点站缩写
+        dest = last_stations[destination.partition('|')[0]]  # 终点站缩写
         
         # 处理环线
         if all_routes[route_id]['circularState'] == 'CLOCKWISE':
@@ -912,28 +1124,58 @@ def get_sta_directions(data, station, template_file):
     '''
     MAX_DIST = 30  # 最大距离阈值
 
-    def min_dist(tuple1, tuples):
+    def near(tuple1, tuples):
         '''
-        计算两点之间的最小距离
+        检查点列表中是否有点与给定点的距离在阈值内，找到后立即返回
         
         Args:
-            tuple1: 第一个点的坐标
+            tuple1: 给定点的坐标
             tuples: 点的列表
             
         Returns:
-            最小距离和对应的索引
+            是否有点在距离阈值内
         '''
-        dists = []
-        for tuple2 in tuples:
-            dist = 0
-            for i in range(3):
-                dist += abs(tuple1[i] - tuple2[i])  # 计算曼哈顿距离
+        x1, y1, z1 = tuple1
+        for x2, y2, z2 in tuples:
+            # 计算曼哈顿距离
+            if abs(x1 - x2) + abs(y1 - y2) + abs(z1 - z2) <= MAX_DIST:
+                return True
 
-            dists.append(dist)
-            # dists.append(abs(tuple1[0] - tuple2[0]))
-            # dists.append(abs(tuple1[2] - tuple2[2]))
+        return False
+
+    def any_near(tuples1, tuples2):
+        '''
+        检查两个点列表中是否有一对点的距离在阈值内
+        
+        Args:
+            tuples1: 第一个点列表
+            tuples2: 第二个点列表
+            
+        Returns:
+            是否有一对点在距离阈值内
+        '''
+        if len(tuples2) <= 27:
+            # 点数较少时直接逐个比较
+            return any(near(x, tuples2) for x in tuples1)
+
+        # 把第二个列表的点放入边长为阈值的网格，距离在阈值内的点
+        # 每个坐标相差都不超过阈值，只可能在相邻的网格中
+        grid = {}
+        for x2, y2, z2 in tuples2:
+            grid.setdefault((x2 // MAX_DIST, y2 // MAX_DIST, z2 // MAX_DIST),
+                            []).append((x2, y2, z2))
+
+        for point in tuples1:
+            x1, y1, z1 = point
+            cx, cy, cz = x1 // MAX_DIST, y1 // MAX_DIST, z1 // MAX_DIST
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        cell = grid.get((cx + dx, cy + dy, cz + dz))
+                        if cell is not None and near(point, cell):
+                            return True
 
-        return min(dists), dists.index(min(dists))
+        return False
 
     def find_connected_components(graph: dict[str]):
         '''
@@ -948,19 +1190,22 @@ def get_sta_directions(data, station, template_file):
         visited = set()
         components = []
 
-        def dfs(node, component: set):
-            '''深度优先搜索''' 
+        for node in graph:
+            if node in visited:
+                continue
+
+            # 使用栈进行深度优先搜索，避免递归的开销和深度限制
             visited.add(node)
-            component.add(node)
-            for neighbor in graph.get(node, []):
-                if neighbor not in visited:
-                    dfs(neighbor, component)
+            component = [node]
+            stack = [node]
+            while stack:
+                for neighbor in graph.get(stack.pop(), ()):
+                    if neighbor not in visited:
+                        visited.add(neighbor)
+                        component.append(neighbor)
+                        stack.append(neighbor)
 
-        for node in graph:
-            if node not in visited:
-                component = set()
-                dfs(node, component)
-                components.append(tuple(sorted(component)))
+            components.append(tuple(sorted(component)))
 
         return components
 
@@ -979,6 +1224,24 @@ def get_sta_directions(data, station, template_file):
 
     routes: list[str] = data['station_routes'][station_id]  # 车站所属的线路
     same_direction: dict[str, list] = {}  # 同方向线路映射
+    positions = _route_station_positions(data)  # 各线路上车站的位置
+    # 每条线路的站台坐标，只为通过筛选的线路构建，之后两两比较时复用
+    coords: dict[str, list] = {}
+
+    def route_coords(route_id):
+        '''
+        获取线路经过的站台坐标，首次使用时构建
+        
+        Args:
+            route_id: 线路ID
+            
+        Returns:
+            站台坐标(x, y, z)的列表
+        '''
+        if route_id not in coords:
+            coords[route_id] = [(sta['x'], sta['y'], sta['z'])
+                                for sta in data['routes'][route_id]['stations']]
+        return coords[route_id]
     
     # 遍历每条线路
     for route_id1 in routes:
@@ -986,11 +1249,10 @@ def get_sta_directions(data, station, template_file):
         if route_data1['hidden'] is True:
             continue  # 跳过隐藏的线路
 
-        stations1 = route_data1['stations']  # 线路经过的车站
-        station_ids1 = [x['id'] for x in route_data1['stations']]  # 车站ID列表
-        i1 = station_ids1.index(station_id)  # 当前车站在线路中的索引
-        if i1 == len(station_ids1) - 1:
+        i1 = positions[route_id1][station_id]  # 当前车站在线路中的索引
+        if i1 == len(route_data1['stations']) - 1:
             continue  # 跳过终点站
+        coords1 = route_coords(route_id1)  # 线路经过的站台坐标
 
         if route_id1 not in same_direction:
             same_direction[route_id1] = []
@@ -1012,10 +1274,8 @@ def get_sta_directions(data, station, template_file):
                                                route_data2['type']]):
                     continue
 
-            stations2 = route_data2['stations']  # 线路经过的车站
-            station_ids2 = [x['id'] for x in route_data2['stations']]  # 车站ID列表
-            i2 = station_ids2.index(station_id)  # 当前车站在线路中的索引
-            if i2 == len(station_ids2) - 1:
+            i2 = positions[route_id2][station_id]  # 当前车站在线路中的索引
+            if i2 == len(route_data2['stations']) - 1:
                 continue  # 跳过终点站
 
             if route_id2 not in same_direction:
@@ -1025,132 +1285,71 @@ def get_sta_directions(data, station, template_file):
                 continue  # 跳过已处理的线路
 
             # 获取站台坐标
-            plat1 = (stations1[i1]['x'], stations1[i1]['y'],
-                     stations1[i1]['z'])
-            plat2 = (stations2[i2]['x'], stations2[i2]['y'],
-                     stations2[i2]['z'])
-            if plat1 == plat2:
+            coords2 = route_coords(route_id2)  # 线路经过的站台坐标
+            if coords1[i1] == coords2[i2]:
                 same_direction[route_id1].append(route_id2)
                 continue
 
-            # 获取后续车站的坐标
-            plats1 = [(sta['x'], sta['y'], sta['z'])
-                      for sta in stations1[i1 + 1:-1]]
-            plats2 = [(sta['x'], sta['y'], sta['z'])
-                      for sta in stations2[i2 + 1:-1]]
-            
-            # 处理只有终点站的情况
-            if plats1 == []:
-                plats1 = [(sta['x'], sta['y'], sta['z'])
-                          for sta in [stations1[-1]]]
-                plats2 = [(sta['x'], sta['y'], sta['z'])
-                          for sta in stations2[i2 + 1:]]
-
-            if plats2 == []:
-                plats1 = [(sta['x'], sta['y'], sta['z'])
-                          for sta in stations1[i1 + 1:]]
-                plats2 = [(sta['x'], sta['y'], sta['z'])
-                          for sta in [stations2[-1]]]
-
-            if plats1 == [] or plats2 == []:
-                continue
+            # 获取后续车站的坐标，不包括终点站；
+            # 其中一条线路的下一站就是终点站时，两条线路都包括终点站
+            # （当前车站都不是终点站，取到的坐标不会为空）
+            if i1 + 2 == len(coords1) or i2 + 2 == len(coords2):
+                plats1 = coords1[i1 + 1:]
+                plats2 = coords2[i2 + 1:]
+            else:
+                plats1 = coords1[i1 + 1:-1]
+                plats2 = coords2[i2 + 1:-1]
 
             # 检查距离是否在阈值内
-            if min_dist(plats1[0], plats2)[0] > MAX_DIST and \
-                    min_dist(plats2[0], plats1)[0] > MAX_DIST:
+            if not near(plats1[0], plats2) and not near(plats2[0], plats1):
                 continue
 
             # 检查是否有车站在距离阈值内
-            for x in plats1:
-                min_distance = min_dist(x, plats2)
-                if min_distance[0] <= MAX_DIST:
-                    same_direction[route_id1].append(route_id2)
-                    break
+            if any_near(plats1, plats2):
+                same_direction[route_id1].append(route_id2)
 
     # 查找连通组件
     components = find_connected_components(same_direction)
-    result = []
-    result_2 = []
-    for x in components:
-        t: tuple[str] = tuple(data['routes'][y]['name'] for y in x)
-        t2 = tuple(x.split('|')[0] for x in t)
-        result.append(t)
-        result_2.append(t2)
-
-    # 构建图
-    graph: dict[str, list] = {}
-    graph_2: dict[str, list] = {}
-    graph_3: dict[str, list] = {}
-    for i1, x1 in enumerate(result_2):
-        item1_1 = result[i1]
-        if item1_1 not in graph:
-            graph[item1_1] = []
-
-        item1_2 = result_2[i1]
-        if item1_2 not in graph_2:
-            graph_2[item1_2] = []
-
-        item1_3 = components[i1]
-        if item1_3 not in graph_3:
-            graph_3[item1_3] = []
-
-        if i1 == len(result_2) - 1:
-            break
-
-        for i2, x2 in enumerate(result_2[i1 + 1:]):
-            i2 += i1 + 1
-            have_same = len([x for x in x1 if x in x2]) > 0  # 检查是否有相同的线路
-
-            item2_1 = result[i2]
-            if item2_1 not in graph:
-                graph[item2_1] = []
-
-            if have_same is True:
-                graph[item1_1].append(item2_1)
-                graph[item2_1].append(item1_1)
-
-            item2_2 = result_2[i2]
-            if item2_2 not in graph_2:
-                graph_2[item2_2] = []
-
-            if have_same is True:
-                graph_2[item1_2].append(item2_2)
-                graph_2[item2_2].append(item1_2)
-
-            item2_3 = components[i2]
-            if item2_3 not in graph_3:
-                graph_3[item2_3] = []
-
-            if have_same is True:
-                graph_3[item1_3].append(item2_3)
-                graph_3[item2_3].append(item1_3)
+    # 每个组件中线路名称的第一部分
+    short_names = {x: tuple([data['routes'][y]['name'].partition('|')[0] for y in x])
+                   for x in components}
+
+    # 构建图，两个组件有相同的线路名称时连接；名称相同的组件必然相连，
+    # 按线路ID的组件分组与按线路名称分组的结果一致
+    graph: dict[tuple, list] = {x: [] for x in components}
+    name_sets = [frozenset(short_names[x]) for x in components]  # 用于判断是否有相同的线路
+    for i1 in range(len(components)):
+        for i2 in range(i1 + 1, len(components)):
+            # 检查是否有相同的线路
+            if name_sets[i1].isdisjoint(name_sets[i2]):
+                continue
+
+            graph[components[i1]].append(components[i2])
+            graph[components[i2]].append(components[i1])
 
     # 查找连通组件
     same_ids = find_connected_components(graph)
-    same_ids_2 = find_connected_components(graph_2)
-    same_ids_3 = find_connected_components(graph_3)
     
     # 获取车站信息
     sta_data = data['stations'][station_id]
-    sta_name = sta_data['name'].split('|')[0]  # 车站名称
-    short_id = int('0x' + sta_data['station'], 16)  # 车站短ID
+    sta_name = sta_data['name'].partition('|')[0]  # 车站名称
+    short_id = int(sta_data['station'], 16)  # 车站短ID
 
     # 读取HTML模板
-    with open(template_file, 'r', encoding='utf-8') as f:
-        html = f.read()
+    html = _load_text(template_file)
 
+    station_names, _ = _display_names(data)  # 车站的显示名称
     sta_directions_table = {}  # 方向表
-    template = ''  # 模板字符串
+    template = []  # 模板字符串的各个部分
     template1 = '...({{id}}) {{sta}}方向...\n'  # 方向模板
     count = 1  # 计数
     height = 87  # 高度
     
     # 遍历连通组件
-    for index, routes in enumerate(same_ids):
-        all_routes = set(y for x in same_ids_2[index] for y in x)  # 所有线路
+    for all_route_ids in same_ids:
+        all_routes = set(chain.from_iterable(short_names[x] for x in all_route_ids))  # 所有线路
         all_names = '/<br>&nbsp;'.join(sorted(all_routes))  # 线路名称
-        template += f'''...{all_names}...\n'''
-        all_route_ids = same_ids_3[index]  # 所有线路ID
+        template.append(f'''...{all_names}...\n''')
         
         for x in all_route_ids:
             next_stations = []  # 下一站列表
@@ -1169,17 +1368,14 @@ def get_sta_directions(data, station, template_file):
                     last_stations.append(dest)
                     continue
 
-                station_ids: list[str] = [
-                    y['id'] for y in route_data['stations']]  # 车站ID列表
-                stations_names: list[str] = [data['stations'][y]['name']
-                                             for y in station_ids]  # 车站名称列表
-                if station_id not in station_ids:
+                route_stations = route_data['stations']  # 线路经过的车站
+                i = positions[z].get(station_id)  # 当前车站在线路中的索引
+                if i is None:
                     continue
 
-                i = station_ids.index(station_id)  # 当前车站在线路中的索引
-                if i != len(station_ids) - 1:
-                    next_station = stations_names[i + 1].split('|')[0]  # 下一站
-                    last_station = stations_names[-1].split('|')[0]  # 终点站
+                if i != len(route_stations) - 1:
+                    next_station = station_names[route_stations[i + 1]['id']]  # 下一站
+                    last_station = station_names[route_stations[-1]['id']]  # 终点站
                     
                     # 处理包含WIP的终点站
                     if 'WIP' in last_station:
@@ -1203,19 +1399,100 @@ def get_sta_directions(data, station, template_file):
             # 构建方向模板
             template2 = template1.replace('{{sta}}', '/'.join(last_stations))
             template2 = template2.replace('{{id}}', str(count))
-            template += template2
+            template.append(template2)
             sta_directions_table[count] = x  # 添加到方向表
             count += 1
 
-        template += '</ul></dd></dl>\n'
+        template.append('</ul></dd></dl>\n')
         height += 120  # 增加高度
 
     # 替换模板变量
-    html = html.replace('{{template}}', template)
+    html = html.replace('{{template}}', ''.join(template))
     html = html.replace('{{station}}', f'{sta_name} ({short_id})')
     return html, (800, height), sta_directions_table
 
 
+_file_cache = {}  # 文件路径 -> (修改时间, 文件内容)
+
+
+def _cached_load(path: str, read):
+    '''
+    读取文件，文件未被修改时直接返回上次读取的结果
+    
+    Args:
+        path: 文件路径
+        read: 从文件中读取内容的函数
+        
+    Returns:
+        文件内容
+    '''
+    mtime = os.stat(path).st_mtime_ns
+    cached = _file_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    result = read(path)
+    _file_cache[path] = (mtime, result)
+    return result
+
+
+def _read_json(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class _DataUnpickler(pickle.Unpickler):
+    '''时刻表数据只包含dict/list/tuple/int/str，拒绝加载其他任何对象'''
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f'时刻表数据中不允许出现对象: {module}.{name}')
+
+
+def _read_pickle(path):
+    # 通过mmap直接从页缓存读取，避免先把整个文件复制到内存
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _DataUnpickler(mm).load()
+
+
+def _write_pickle(obj, path):
+    '''
+    将对象写入pickle文件，先写入临时文件再替换，读取方不会读到写了一半的文件
+    
+    Args:
+        obj: 要保存的对象
+        path: 文件路径
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    os.replace(tmp_path, path)
+
+
+def _load_json(path: str):
+    '''读取JSON文件，多次调用时复用已读取的结果'''
+    return _cached_load(path, _read_json)
+
+
+def _load_text(path: str):
+    '''读取文本文件（HTML模板），多次调用时复用已读取的结果'''
+    return _cached_load(path, _read_text)
+
+
+def _load_pickle(path: str):
+    '''读取pickle文件，多次调用时复用已读取的结果'''
+    return _cached_load(path, _read_pickle)
+
+
 def main_route_random_train(LOCAL_FILE_PATH, LOCAL_FILE_PATH_V3,
                             DATABASE_PATH, route_name,
                             departure_time=None) -> tuple[str, tuple]:
@@ -1233,16 +1510,13 @@ def main_route_random_train(LOCAL_FILE_PATH, LOCAL_FILE_PATH_V3,
         包含HTML字符串和尺寸的元组，或None表示失败
     '''
     # 加载列车时刻表数据
-    with open(DATABASE_PATH + 'train_timetable_data.dat', 'rb') as f:
-        database = pickle.load(f)
+    database = _load_pickle(DATABASE_PATH + 'train_timetable_data.dat')
 
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH)
 
     # 加载v3格式的线路信息
-    with open(LOCAL_FILE_PATH_V3, encoding='utf-8') as f:
-        data_v3 = json.load(f)
+    data_v3 = _load_json(LOCAL_FILE_PATH_V3)
 
     # 获取列车信息
     train_data = route_random_train(data_v3, data, route_name,
@@ -1267,12 +1541,10 @@ def main_random_train(LOCAL_FILE_PATH, DATABASE_PATH,
         包含HTML字符串和尺寸的元组
     '''
     # 加载列车时刻表数据
-    with open(DATABASE_PATH + 'train_timetable_data.dat', 'rb') as f:
-        database = pickle.load(f)
+    database = _load_pickle(DATABASE_PATH + 'train_timetable_data.dat')
 
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH)
 
     try:
         # 获取随机列车信息
@@ -1300,16 +1572,13 @@ def main_train(LOCAL_FILE_PATH, DATABASE_PATH_1, DATABASE_PATH_2,
         包含HTML字符串和尺寸的元组，或None/False表示失败
     '''
     # 加载列车时刻表数据
-    with open(DATABASE_PATH_1 + 'train_timetable_data.dat', 'rb') as f:
-        train_timetable = pickle.load(f)
+    train_timetable = _load_pickle(DATABASE_PATH_1 + 'train_timetable_data.dat')
 
     # 加载车站时刻表数据
-    with open(DATABASE_PATH_2 + 'station_timetable_data.dat', 'rb') as f:
-        station_timetable = pickle.load(f)
+    station_timetable = _load_pickle(DATABASE_PATH_2 + 'station_timetable_data.dat')
 
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH)
 
     # 获取列车信息
     train_data = get_train(data, station_name, train_id,
@@ -1335,12 +1604,10 @@ def main_text_timetable(LOCAL_FILE_PATH, DATABASE_PATH,
         文本格式的时刻表字符串，或None表示失败
     '''
     # 加载车站时刻表数据
-    with open(DATABASE_PATH + 'station_timetable_data.dat', 'rb') as f:
-        station_timetable = pickle.load(f)
+    station_timetable = _load_pickle(DATABASE_PATH + 'station_timetable_data.dat')
 
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH)
 
     # 获取文本格式时刻表
     return get_text_timetable(data, station_name,
@@ -1363,16 +1630,13 @@ def main_sta_timetable(LOCAL_FILE_PATH, LOCAL_FILE_PATH_2,
         HTML格式的时刻表字符串，或None/False表示失败
     '''
     # 加载车站时刻表数据
-    with open(DATABASE_PATH + 'station_timetable_data.dat', 'rb') as f:
-        station_timetable = pickle.load(f)
+    station_timetable = _load_pickle(DATABASE_PATH + 'station_timetable_data.dat')
 
     # 加载v3格式的线路信息
-    with open(LOCAL_FILE_PATH, encoding='utf-8') as f:
-        data_v3 = json.load(f)
+    data_v3 = _load_json(LOCAL_FILE_PATH)
 
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH_2, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH_2)
 
     # 获取HTML格式时刻表
     return get_sta_timetable(data_v3, data, station_name, route_names,
@@ -1393,8 +1657,7 @@ def main_get_sta_directions(LOCAL_FILE_PATH_2, station, template_path):
         包含HTML字符串、尺寸和方向表的元组，或None表示失败
     '''
     # 加载车站和线路信息
-    with open(LOCAL_FILE_PATH_2, encoding='utf-8') as f:
-        data = json.load(f)
+    data = _load_json(LOCAL_FILE_PATH_2)
 
     # 获取线路方向信息
     return get_sta_directions(data, station, template_path)
@@ -1415,42 +1678,48 @@ def gen_departure_data(data, filename1, filename2, DEP_PATH, IGNORED_LINES):
         包含车站线路发车数据、列车数据和所有线路发车数据的元组
     '''
     # 加载发车数据
-    with open(DEP_PATH, 'r', encoding='utf-8') as f:
-        dep_data: dict[str, list[int]] = json.load(f)
+    dep_data: dict[str, list[int]] = _read_json(DEP_PATH)
 
     station_route_dep: dict[str, dict[str, list[int]]] = {}  # 车站线路发车数据
     all_route_dep: dict[str, dict[str, list[int]]] = {}  # 所有线路发车数据
     trains: dict[str, list] = {}  # 列车数据
     station_train_id = {}  # 车站列车ID计数器
+    stations = data['stations']  # 车站信息
+    routes = data['routes']  # 线路信息
+    ignored_lines = set(IGNORED_LINES)  # 忽略的线路名称
     
     # 遍历每条线路的发车数据
     for route_id, departures in dep_data.items():
-        if route_id not in data['routes']:
+        route = routes.get(route_id)  # 线路信息
+        if route is None:
             continue
 
-        route = data['routes'][route_id]  # 线路信息
         n: str = route['name']  # 线路名称
-        if n in IGNORED_LINES:
+        if n in ignored_lines:
+            continue
+
+        durations = route['durations']  # 运行时间
+        if durations == []:
             continue
 
         # 提取英文名称
         try:
             eng_name = n.split('|')[1].split('|')[0]
             if eng_name == '':
-                eng_name = n.split('|')[0]
+                eng_name = n.partition('|')[0]
         except IndexError:
-            eng_name = n.split('|')[0]
+            eng_name = n.partition('|')[0]
 
-        durations = route['durations']  # 运行时间
-        if durations == []:
-            continue
+        # 线路ID、线路名称和车站ID会在数据中重复出现成千上万次，
+        # 驻留后共用同一个字符串对象，减少内存并加快字典查找
+        route_id = sys.intern(route_id)
+        eng_name = sys.intern(eng_name)
 
-        if route_id not in trains:
-            trains[route_id] = []
+        route_trains = trains.setdefault(route_id, [])
 
+        real_ids = [sys.intern(x['id']) for x in route['stations']]  # 车站实际ID列表
         # 获取车站短ID列表
-        station_ids = [data['stations'][x['id']]['station']
-                       for x in route['stations']]
+        station_ids = [stations[x]['station'] for x in real_ids]
         
         # 处理运行时间长度
         if len(station_ids) - 1 < len(durations):
@@ -1459,19 +1728,14 @@ def gen_departure_data(data, filename1, filename2, DEP_PATH, IGNORED_LINES):
         if len(station_ids) - 1 > len(durations):
             continue
 
-        # 处理发车时间
-        departures_new = []
-        for x in departures:
-            if x < 0:
-                x += 86400
-            elif x >= 86400:
-                x -= 86400
-            departures_new.append(x)
-
-        real_ids = [x['id'] for x in route['stations']]  # 车站实际ID列表
-        dwells = [x['dwellTime'] for x in route['stations']]  # 停站时间
+        # 处理发车时间，统一到一天之内
+        departures_new = [x % 86400 for x in departures]
+
+        # 运行时间和停站时间预先换算成秒
+        durations = [round(x / 1000) for x in durations]
+        dwells = [round(x['dwellTime'] / 1000) for x in route['stations']]
         if len(dwells) > 0:
-            dep = -round(dwells[-1] / 1000)
+            dep = -dwells[-1]
         else:
             dep = 0
 
@@ -1483,64 +1747,61 @@ def gen_departure_data(data, filename1, filename2, DEP_PATH, IGNORED_LINES):
             station2 = station_ids[i]  # 后一站短ID
             _station1 = real_ids[i - 1]  # 前一站实际ID
             _station2 = real_ids[i]  # 后一站实际ID
-            dur = round(durations[i - 1] / 1000)  # 运行时间（秒）
+            dur = durations[i - 1]  # 运行时间（秒）
             arr_time = dep  # 到达时间
             dep_time = dep - dur  # 发车时间
-            dwell = round(dwells[i - 1] / 1000)  # 停站时间（秒）
+            dwell = dwells[i - 1]  # 停站时间（秒）
             dep -= dur  # 更新时间
             dep -= dwell
             if station1 == station2:
                 continue
 
-            # 添加到时刻表
-            timetable.insert(0, arr_time)
-            timetable.insert(0, dep_time)
-
-            # 初始化车站列车ID计数器
-            if _station1 not in station_train_id:
-                station_train_id[_station1] = 1
-
-            # 初始化车站线路发车数据
-            if _station1 not in station_route_dep:
-                station_route_dep[_station1] = {}
-
-            if eng_name not in station_route_dep[_station1]:
-                station_route_dep[_station1][eng_name] = []
-
-            # 初始化所有线路发车数据
-            if _station1 not in all_route_dep:
-                all_route_dep[_station1] = {}
-
-            # 处理每个发车时间
-            for i, x in enumerate(departures_new):
-                new_dep = (dep_time + x + 8 * 60 * 60) % 86400  # 计算新的发车时间
-                train_id = station_train_id[_station1]  # 列车ID
-                # 添加到车站线路发车数据
-                station_route_dep[_station1][eng_name].append(
-                    (route_id, new_dep, (i, train_id)))
-                # 添加到所有线路发车数据
-                all_route_dep[_station1][train_id] = \
-                    (route_id, i, new_dep)
-                station_train_id[_station1] += 1
-
-            # 按时间排序
-            station_route_dep[_station1][eng_name].sort()
+            # 添加到时刻表（倒序添加，循环结束后再反转）
+            timetable.append(arr_time)
+            timetable.append(dep_time)
+
+            # 循环中用到的字典和时间偏移提前取出，不存在时初始化
+            route_dep = station_route_dep.setdefault(_station1, {}) \
+                .setdefault(eng_name, [])  # 车站线路发车数据
+            station_dep = all_route_dep.setdefault(_station1, {})  # 所有线路发车数据
+            train_id = station_train_id.get(_station1, 1)  # 列车ID
+            offset = dep_time + 8 * 60 * 60
+
+            # 计算每个发车时间在本站的发车时间，并依次分配列车ID
+            new_deps = [(offset + x) % 86400 for x in departures_new]
+            indices = range(len(new_deps))
+            train_ids = range(train_id, train_id + len(new_deps))
+            # 添加到车站线路发车数据
+            route_dep.extend(zip(repeat(route_id), new_deps,
+                                 zip(indices, train_ids)))
+            # 添加到所有线路发车数据
+            station_dep.update(zip(train_ids, zip(repeat(route_id),
+                                                  indices, new_deps)))
+            station_train_id[_station1] = train_id + len(new_deps)
 
         if timetable == []:
             continue
 
-        # 生成列车时刻表
-        for x in departures_new:
-            new_timetable = [y + x + 8 * 60 * 60 for y in timetable]
-            trains[route_id].append(new_timetable)
+        timetable.reverse()
+
+        # 生成列车时刻表，时区偏移先加到时刻表上
+        timetable = [y + 8 * 60 * 60 for y in timetable]
+        route_trains.extend([y + x for y in timetable]
+                            for x in departures_new)
+
+    # 所有线路处理完后统一按时间排序
+    for route_deps in station_route_dep.values():
+        for route_dep in route_deps.values():
+            route_dep.sort()
 
-    # 保存数据
-    if filename1 is not None:
-        with open(filename1, 'wb') as f:
-            pickle.dump(all_route_dep, f)
+    # 保存数据，两个文件同时写入
+    with ThreadPoolExecutor() as pool:
+        futures = [pool.submit(_write_pickle, obj, filename)
+                   for obj, filename in ((all_route_dep, filename1),
+                                         (trains, filename2))
+                   if filename is not None]
 
-    if filename2 is not None:
-        with open(filename2, 'wb') as f:
-            pickle.dump(trains, f)
+    for future in futures:
+        future.result()
 
     return station_route_dep, trains, all_route_dep
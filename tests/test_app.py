@@ -0,0 +1,264 @@
+import subprocess
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as appmod
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    '''清空响应缓存，使用可控的时钟和数据快照'''
+    clock = _Clock()
+    snapshot = SimpleNamespace(mtimes={'data': 1.0})
+    monkeypatch.setattr(appmod, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(appmod, '_current', lambda: snapshot)
+    appmod._response_cache.clear()
+    yield SimpleNamespace(clock=clock, snapshot=snapshot)
+    appmod._response_cache.clear()
+
+
+def _counting_view(policy='short'):
+    '''返回被cached装饰的接口，以及记录每次实际执行时表单参数的列表'''
+    calls = []
+
+    @appmod.cached(policy)
+    def view():
+        calls.append(appmod.request.form.to_dict(flat=False))
+        if appmod.request.form.get('fail'):
+            return appmod._error(appmod.ERR_TRAIN_NOT_FOUND)
+        return {'n': len(calls)}
+
+    return view, calls
+
+
+def _call(view, path='/station', data=None):
+    with appmod.app.test_request_context(path, method='POST', data=data or {}):
+        return view().get_data()
+
+_DUMP_SCRIPT = '''
+import sys
+from types import SimpleNamespace
+if sys.argv[1] == 'no-orjson':
+    sys.modules['orjson'] = None
+import app
+payload = {'b': 1, 'a': '東京', 'c': [1, {'z': 2, 'y': None}]}
+with app.app.app_context():
+    sys.stdout.buffer.write(app._json_bytes(payload) + b'|'
+                            + app.app.json.response(payload).get_data())
+'''
+
+
+def _dump(mode):
+    return subprocess.run([sys.executable, '-c', _DUMP_SCRIPT, mode],
+                          cwd=appmod.os.path.dirname(appmod.__file__),
+                          check=True, capture_output=True).stdout
+
+
+def test_json_output_same_with_and_without_orjson():
+    with_orjson = _dump('orjson')
+    assert with_orjson == _dump('no-orjson')
+    assert with_orjson.split(b'|')[0] == \
+        '{"a":"東京","b":1,"c":[1,{"y":null,"z":2}]}'.encode()
+
+
+def test_etag_only_on_successful_responses(cache):
+    view, _ = _counting_view('long')
+    view = appmod.etagged(view)
+
+    with appmod.app.test_request_context('/train', method='POST', data={'fail': '1'}):
+        response = view()
+    assert response.get_data() == appmod.ERR_TRAIN_NOT_FOUND
+    assert response.get_etag() == (None, None)
+    assert 'Cache-Control' not in response.headers
+
+    with appmod.app.test_request_context('/train', method='POST', data={}):
+        response = view()
+    assert response.get_etag()[0] is not None
+    assert response.headers['Cache-Control'] == 'max-age=10'
+
+
+def test_random_train_not_etagged():
+    client = appmod.app.test_client()
+    response = client.get('/random_train')
+    assert response.get_etag() == (None, None)
+    assert 'Cache-Control' not in response.headers
+
+
+def test_preload_does_not_start_refresher(monkeypatch):
+    started = []
+    monkeypatch.setattr(appmod, '_snapshot', None)
+    monkeypatch.setattr(appmod, '_refresher_started', False)
+    monkeypatch.setattr(appmod, '_Snapshot', lambda mtimes: mtimes)
+    monkeypatch.setattr(appmod.threading, 'Thread',
+                        lambda **kwargs: SimpleNamespace(start=lambda: started.append(1)))
+
+    appmod.preload_data()
+    assert appmod._snapshot is not None
+    assert not started and not appmod._refresher_started
+
+    assert appmod._current() is appmod._snapshot
+    appmod._current()
+    assert started == [1]
+
+
+def test_cache_hit_and_ttl_expiry(cache):
+    view, calls = _counting_view('short')
+    assert _call(view) == b'{"n":1}'
+    cache.clock.now += appmod._CACHE_TTL['short'] - 1
+    assert _call(view) == b'{"n":1}'
+    assert len(calls) == 1
+    cache.clock.now += 1
+    assert _call(view) == b'{"n":2}'
+    assert len(calls) == 2
+
+
+def test_cache_evicts_oldest_entry(cache, monkeypatch):
+    monkeypatch.setattr(appmod, '_CACHE_MAX_SIZE', 2)
+    view, calls = _counting_view()
+    for q in 'abc':
+        _call(view, data={'q': q})
+    assert len(appmod._response_cache) == 2
+    _call(view, data={'q': 'c'})
+    _call(view, data={'q': 'b'})
+    assert len(calls) == 3
+    _call(view, data={'q': 'a'})
+    assert len(calls) == 4
+
+
+def test_cache_recently_used_entry_not_evicted(cache, monkeypatch):
+    monkeypatch.setattr(appmod, '_CACHE_MAX_SIZE', 2)
+    view, calls = _counting_view('short')
+    _call(view, data={'q': 'a'})
+    _call(view, data={'q': 'b'})
+    # a过期后重新计算，移到最新的位置，再插入c时淘汰的是b
+    cache.clock.now += appmod._CACHE_TTL['short']
+    _call(view, data={'q': 'a'})
+    _call(view, data={'q': 'c'})
+    assert len(calls) == 4
+    _call(view, data={'q': 'a'})
+    assert len(calls) == 4
+    _call(view, data={'q': 'b'})
+    assert len(calls) == 5
+
+
+def test_stale_entry_returned_when_query_fails(cache):
+    state = {'fail': False}
+    calls = []
+
+    @appmod.cached('short')
+    def view():
+        calls.append(1)
+        if state['fail']:
+            return appmod._error(appmod.ERR_STATION_NOT_FOUND)
+        return {'n': len(calls)}
+
+    assert _call(view, data={'q': 'a'}) == b'{"n":1}'
+    cache.clock.now += appmod._CACHE_TTL['short']
+    state['fail'] = True
+    assert _call(view, data={'q': 'a'}) == b'{"n":1}'
+    # 没有旧结果时返回错误响应，且错误不会写入缓存
+    assert _call(view, data={'q': 'b'}) == appmod.ERR_STATION_NOT_FOUND
+    assert _call(view, data={'q': 'b'}) == appmod.ERR_STATION_NOT_FOUND
+    assert len(calls) == 4
+
+
+def test_follower_receives_leader_exception():
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        raise ValueError('boom')
+
+    key = ('test', 'follower')
+    results = {}
+
+    def run(name):
+        try:
+            appmod._single_flight(key, compute)
+        except Exception as e:
+            results[name] = e
+
+    leader = threading.Thread(target=run, args=('leader',))
+    leader.start()
+    deadline = time.monotonic() + 5
+    while key not in appmod._inflight and time.monotonic() < deadline:
+        time.sleep(0.001)
+    follower = threading.Thread(target=run, args=('follower',))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == [1]
+    assert isinstance(results['leader'], ValueError)
+    assert results['follower'] is results['leader']
+    assert key not in appmod._inflight
+
+
+def test_cache_key_separates_endpoints_and_form_items(cache):
+    view, calls = _counting_view()
+    _call(view, '/station', {'q': 'a'})
+    _call(view, '/train', {'q': 'a'})
+    _call(view, '/station', {'q': 'a', 'r': 'x'})
+    assert len(calls) == 3
+    # 不同参数的先后顺序不影响缓存键
+    _call(view, '/station', {'r': 'x', 'q': 'a'})
+    assert len(calls) == 3
+
+
+def test_cache_key_uses_first_value_of_repeated_items(cache):
+    # 接口用request.form.get读取参数，重复的参数只有第一个值起作用
+    @appmod.cached('long')
+    def view():
+        return {'route': appmod.request.form.get('route_name')}
+
+    assert _call(view, '/route', {'route_name': ['Z', '1']}) == b'{"route":"Z"}'
+    assert _call(view, '/route', {'route_name': ['1', 'Z']}) == b'{"route":"1"}'
+    assert _call(view, '/route', {'route_name': ['Z', '2']}) == b'{"route":"Z"}'
+    assert len(appmod._response_cache) == 2
+
+
+def test_cache_key_changes_with_data_refresh(cache):
+    view, calls = _counting_view('long')
+    assert _call(view, '/route') == b'{"n":1}'
+    assert _call(view, '/route') == b'{"n":1}'
+    cache.snapshot.mtimes = {'data': 2.0}
+    assert _call(view, '/route') == b'{"n":2}'
+    assert len(calls) == 2
+
+
+def test_cache_concurrent_store_and_evict(cache, monkeypatch):
+    monkeypatch.setattr(appmod, '_CACHE_MAX_SIZE', 8)
+    view, _ = _counting_view('short')
+    errors = []
+
+    def run(n):
+        try:
+            for i in range(200):
+                _call(view, data={'q': f'{n}-{i % 20}'})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert errors == []
+    assert len(appmod._response_cache) == appmod._CACHE_MAX_SIZE
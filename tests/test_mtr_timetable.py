@@ -0,0 +1,52 @@
+import json
+import os
+
+import pytest
+
+import mtr_timetable_github as mtr
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+TEMPLATE = os.path.join(FIXTURES, 'station_template.htm')
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+# expected.json由重构前的实现在同一份数据上生成，
+# 包含隐藏线路、不同类型的线路、长线路和环线经过的车站
+EXPECTED = _fixture('expected.json')
+
+
+def _roundtrip(obj):
+    return json.loads(json.dumps(obj))
+
+
+@pytest.fixture(scope='module')
+def timetable():
+    data = _fixture('data.json')
+    _, train_timetable, station_timetable = mtr.gen_departure_data(
+        data, None, None, os.path.join(FIXTURES, 'departures.json'), [])
+    return data, station_timetable, train_timetable
+
+
+@pytest.mark.parametrize('station, departure_time, expected', EXPECTED['text'])
+def test_get_text_timetable(timetable, station, departure_time, expected):
+    data, station_timetable, _ = timetable
+    result = mtr.get_text_timetable(data, station, departure_time, station_timetable)
+    assert _roundtrip(result) == expected
+
+
+@pytest.mark.parametrize('station, expected', EXPECTED['dirs'])
+def test_get_sta_directions(timetable, station, expected):
+    data, _, _ = timetable
+    result = mtr.get_sta_directions(data, station, TEMPLATE)
+    assert _roundtrip(result) == expected
+
+
+@pytest.mark.parametrize('station, train_id, expected', EXPECTED['train'])
+def test_get_train(timetable, station, train_id, expected):
+    data, station_timetable, train_timetable = timetable
+    result = mtr.get_train(data, station, train_id, station_timetable, train_timetable)
+    assert _roundtrip(result) == expected
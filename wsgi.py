@@ -0,0 +1,13 @@
+'''
+WSGI入口，用于生产环境部署：
+    gunicorn -w $(nproc) --preload wsgi:app
+'''
+import gc
+
+from app import app, preload_data, warmup
+
+# 在主进程中加载数据，fork出的工作进程通过写时复制共享同一份数据
+preload_data()
+warmup()
+# 将已加载的对象移出垃圾回收跟踪，避免工作进程中的GC扫描触发页面复制
+gc.freeze()